@@ -1,7 +1,7 @@
 import streamlit as st
 import time
 import pandas as pd
-from llm import process_resume_request, clean_workspace, save_resume_to_pdf
+from llm import process_resume_request, clean_workspace, save_resume_to_pdf, render_resume_template, validate_user_input, load_api_key
 import requests
 import json
 import os
@@ -9,6 +9,127 @@ import toml
 from io import StringIO
 import docx2txt
 import PyPDF2
+import uuid
+from job_queue import JobQueue
+from resume_parser import ParsedResume
+from rate_limit import RateLimiter, client_ip, record_usage
+from job_catalog import JobCatalog, ensure_snapshot
+from rate_limit import usage_summary
+from profiling import (ADMIN_PASSWORD, PROFILE_ENABLED, SLOW_THRESHOLD_MS, TRACE_DIR,
+                       RequestProfiler, check_admin_password, is_local_client, list_traces, stage)
+import pstats
+
+@st.cache_resource
+def get_job_queue():
+    # 每个Streamlit进程共享一个任务队列和工作线程池
+    job_queue = JobQueue(run_resume_job)
+    job_queue.start()
+    return job_queue
+
+
+def run_resume_job(payload):
+    # 后台任务不属于任何一次页面刷新，按提交时会话的设置单独记录性能数据
+    with RequestProfiler('generate_resume', enabled=payload['profile']):
+        return process_resume_request(payload['user_data'], defer_on_rate_limit=True,
+                                      session=payload.get('session'), ip=payload.get('ip'))
+
+
+def profiling_enabled():
+    return PROFILE_ENABLED or (is_admin() and st.session_state.get('profiling', False))
+
+
+def is_admin():
+    if ADMIN_PASSWORD:
+        return st.session_state.get('is_admin', False)
+    # 未设置管理员密码时，只有直接从本机访问的会话可以进入管理页面
+    context = getattr(st, 'context', None)
+    if context is None:
+        return False
+    forwarded = any(context.headers.get(header) for header in ('X-Forwarded-For', 'X-Real-IP', 'Forwarded'))
+    return is_local_client(getattr(context, 'ip_address', None), forwarded)
+
+
+@st.cache_resource
+def get_rate_limiter():
+    return RateLimiter()
+
+
+def get_client_ip():
+    context = getattr(st, 'context', None)
+    if context is None:
+        return None
+    return client_ip(getattr(context, 'ip_address', None), context.headers.get('X-Forwarded-For'))
+
+
+def get_user_id():
+    # 会话ID只保存在服务端，客户端无法通过修改URL换一个新的配额桶
+    if 'user_id' not in st.session_state:
+        st.session_state.user_id = uuid.uuid4().hex
+    return st.session_state.user_id
+
+
+def show_resume_job(job_id):
+    """
+    Render the state of a queued resume job, polling until it finishes
+    :param job_id: Job ID stored in the URL
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        del st.query_params['job']
+        st.warning("This resume request has expired, please generate it again.")
+        return
+
+    user_data = job['payload']['user_data']
+
+    if job['status'] in ('queued', 'running'):
+        # 先用本地模板即时预览，LLM结果返回后替换
+        is_valid, _ = validate_user_input(user_data)
+        if is_valid:
+            st.markdown("### Resume Preview")
+            st.markdown(render_resume_template(user_data))
+        wait = job['run_after'] - time.time()
+        if job['status'] == 'queued' and wait > 1:
+            message = f"Request limit reached, your resume is scheduled in {wait:.0f} seconds..."
+        elif job['status'] == 'queued' and job['blocked']:
+            message = "Waiting for your previous request to finish..."
+        elif job['status'] == 'queued':
+            message = f"Waiting in queue ({job['position']} ahead of you)..."
+        else:
+            message = "Generating your resume..."
+        with st.spinner(message):
+            time.sleep(1)
+        st.rerun()
+
+    result = job['result']
+    if result["status"] == "success":
+        if result.get("source") == "template":
+            st.warning(f"AI generation unavailable, showing the template resume instead. ({result['message']})")
+        st.markdown("### Generated Resume")
+        st.markdown(result["content"])
+
+        # PDF file download
+        pdf_filename = f"resume_{int(time.time())}.pdf"
+        # 使用任务结果中已解析的结构，不再重新解析 Markdown
+        resume = ParsedResume.from_dict(result["resume"]) if "resume" in result else result["content"]
+        with stage('save_resume_to_pdf'):
+            saved = save_resume_to_pdf(resume, pdf_filename, user_data['name'])
+        if saved:
+            with open(pdf_filename, 'rb') as f:
+                st.download_button(
+                    label="Download as PDF",
+                    data=f.read(),
+                    file_name=pdf_filename,
+                    mime="application/pdf"
+                )
+    else:
+        st.error(result["message"])
+
+
+@st.cache_resource(max_entries=1)
+def load_job_catalog(snapshot_dir):
+    # 快照目录随目录导入而变化，作为缓存键自动刷新
+    return JobCatalog(snapshot_dir)
+
 
 def job_list_page():
     # back button
@@ -87,34 +208,26 @@ def job_list_page():
 
     st.title("Job Listings")
 
-    # 读取Excel文件
-    df = pd.read_excel("数据库.xlsx", sheet_name='工作表1')
-
-    # 确保正确的列
-    columns_to_show = ['Job Title', 'Company Name', 'Work City', 'Salary', 'Application Deadline', 'Job Description']
-    df.columns = columns_to_show if len(columns_to_show) == len(df.columns) else df.columns
+    # 读取岗位目录（Excel文件有更新时自动重新导入）
+    catalog = load_job_catalog(ensure_snapshot())
 
     # 搜索和过滤
     search_term = st.text_input("Search Jobs", placeholder="Enter job title or company")
-    city_filter = st.selectbox("Filter by City", ["All"] + list(df['Work City'].unique()))
+    city_filter = st.selectbox("Filter by City", ["All"] + catalog.cities())
 
     # 应用过滤
-    df_filtered = df[
-        (df['Job Title'].str.contains(search_term, case=False) |
-         df['Company Name'].str.contains(search_term, case=False)) &
-        ((df['Work City'] == city_filter) | (city_filter == "All"))
-    ]
+    matches = catalog.search(search_term, None if city_filter == "All" else city_filter)
 
     # 分页
     items_per_page = 5
-    total_pages = (len(df_filtered) - 1) // items_per_page + 1
+    total_pages = (len(matches) - 1) // items_per_page + 1
     page_number = st.number_input("Page", min_value=1, max_value=total_pages, value=1)
 
     start_idx = (page_number - 1) * items_per_page
     end_idx = start_idx + items_per_page
 
     # 显示职位列表
-    for _, job in df_filtered.iloc[start_idx:end_idx].iterrows():
+    for job in map(catalog.row, matches[start_idx:end_idx]):
         st.markdown(f"""
         <div class="job-card">
             <div class="job-title">{job['Job Title']}</div>
@@ -135,7 +248,7 @@ def job_list_page():
         """, unsafe_allow_html=True)
 
     # 分页信息
-    st.write(f"Page {page_number} of {total_pages} | Total Jobs: {len(df_filtered)}")
+    st.write(f"Page {page_number} of {total_pages} | Total Jobs: {len(matches)}")
 
 # Welcome Page Function
 def welcome_page():
@@ -475,25 +588,64 @@ def personal_info_page():
             "honors_won": honors_won
         }
 
-        with st.spinner("Generating your resume..."):
-            result = process_resume_request(user_data)
-
-            if result["status"] == "success":
-                st.markdown("### Generated Resume")
-                st.markdown(result["content"])
-
-                # PDF file download
-                pdf_filename = f"resume_{int(time.time())}.pdf"
-                if save_resume_to_pdf(result["content"], pdf_filename, name):
-                    with open(pdf_filename, 'rb') as f:
-                        st.download_button(
-                            label="Download as PDF",
-                            data=f.read(),
-                            file_name=pdf_filename,
-                            mime="application/pdf"
-                        )
+        is_valid, error_message = validate_user_input(user_data)
+        if is_valid:
+            user_id, ip = get_user_id(), get_client_ip()
+            # 超出配额时排队等待，而不是直接失败
+            wait = get_rate_limiter().acquire(user_id, ip)
+            if wait is None:
+                st.error("You have sent too many requests, please try again later.")
             else:
-                st.error(result["message"])
+                record_usage('request', load_api_key(), session=user_id, ip=ip)
+                st.query_params['job'] = get_job_queue().submit(
+                    user_id, {"user_data": user_data, "profile": profiling_enabled(), "session": user_id, "ip": ip},
+                    delay=wait)
+        else:
+            st.error(error_message)
+
+    if 'job' in st.query_params:
+        show_resume_job(st.query_params['job'])
+
+
+def profiling_page():
+    st.title("Profiling")
+    st.caption(f"Reruns and background jobs slower than {SLOW_THRESHOLD_MS:.0f} ms are recorded while profiling "
+               f"is enabled (OFFERAI_PROFILE=1 or the sidebar toggle).")
+
+    traces = list_traces()
+    if not traces:
+        st.info("No slow requests recorded yet.")
+    else:
+        st.dataframe(pd.DataFrame([{
+            "Time": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(trace["timestamp"])),
+            "Request": trace["name"],
+            "Total (ms)": round(trace["total_ms"]),
+        } for trace in traces]), hide_index=True)
+
+        trace_id = st.selectbox("Trace", [trace["id"] for trace in traces])
+        trace = next(trace for trace in traces if trace["id"] == trace_id)
+        base = os.path.join(TRACE_DIR, trace_id)
+
+        st.subheader("Stage timings")
+        st.dataframe(pd.DataFrame(trace["stages"], columns=["Stage", "Time (ms)"]), hide_index=True)
+
+        if os.path.exists(base + '.prof'):
+            st.subheader("Top functions by cumulative time")
+            stream = StringIO()
+            pstats.Stats(base + '.prof', stream=stream).sort_stats('cumulative').print_stats(30)
+            st.code(stream.getvalue())
+            with open(base + '.prof', 'rb') as f:
+                st.download_button("Download cProfile (.prof)", data=f.read(), file_name=f"{trace_id}.prof")
+        with open(base + '.folded', 'rb') as f:
+            st.download_button("Download flamegraph stacks (.folded)", data=f.read(), file_name=f"{trace_id}.folded")
+
+    st.subheader("API usage (last 24 hours)")
+    since = time.time() - 86400
+    st.dataframe(pd.DataFrame(usage_summary(since),
+                              columns=["API key", "Event", "Requests", "Tokens"]), hide_index=True)
+    st.markdown("**Per session**")
+    st.dataframe(pd.DataFrame(usage_summary(since, by_session=True),
+                              columns=["API key", "Session", "IP", "Event", "Requests", "Tokens"]), hide_index=True)
 
 
 def main():
@@ -509,12 +661,15 @@ def main():
         st.markdown("---")
         # 根据当前页面显示不同的导航选项
         if 'current_page' not in st.session_state:
-            st.session_state.current_page = 'welcome'
+            # 刷新页面时如果有进行中的简历任务，直接回到简历页面
+            st.session_state.current_page = 'personal_info' if 'job' in st.query_params else 'welcome'
 
         if st.session_state.current_page == 'welcome':
             menu = ["Welcome"]
         else:
             menu = ["Resume Generation","Job List"]  # Changed to only show Resume Generation
+            if is_admin():
+                menu.append("Profiling")
 
         choice = st.radio("Navigation", menu)
 
@@ -531,16 +686,41 @@ def main():
             st.session_state.current_page = 'personal_info'
             st.rerun()
 
+        if choice == "Profiling" and st.session_state.current_page != 'profiling':
+            st.session_state.current_page = 'profiling'
+            st.rerun()
+
+        if is_admin():
+            st.markdown("---")
+            st.toggle("Profile this session", key="profiling")
+        elif ADMIN_PASSWORD:
+            st.markdown("---")
+            with st.expander("Admin"):
+                password = st.text_input("Password", type="password", key="admin_password")
+                if password:
+                    if check_admin_password(password):
+                        st.session_state.is_admin = True
+                        st.rerun()
+                    st.error("Incorrect password")
+
     # Render the current page
-    if st.session_state.current_page == 'welcome':
-        welcome_page()
-    elif st.session_state.current_page == 'personal_info':
-        personal_info_page()
-    elif st.session_state.current_page == 'job_list':
-        job_list_page()
-
-    # Clean temporary files
-    clean_workspace()
+    page = st.session_state.current_page
+    with RequestProfiler(page, enabled=profiling_enabled()):
+        if page == 'welcome':
+            with stage('welcome_page'):
+                welcome_page()
+        elif page == 'personal_info':
+            with stage('personal_info_page'):
+                personal_info_page()
+        elif page == 'job_list':
+            with stage('job_list_page'):
+                job_list_page()
+        elif page == 'profiling' and is_admin():
+            profiling_page()
+
+        # Clean temporary files
+        with stage('clean_workspace'):
+            clean_workspace()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,359 @@
+import datetime
+import glob
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import traceback
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from openpyxl import load_workbook
+
+from job_queue import DATA_DIR
+
+CATALOG_DB = os.path.join(DATA_DIR, 'catalog.db')
+# 默认导入仓库目录下的所有工作簿（Excel 打开文件时生成的 ~$ 锁文件除外）
+DEFAULT_SOURCES = '*.xlsx'
+EXCEL_LOCK_PREFIX = '~$'
+
+# 目录字段 -> 显示列名
+CATALOG_COLUMNS = {
+    'title': 'Job Title',
+    'company': 'Company Name',
+    'city': 'Work City',
+    'salary': 'Salary',
+    'deadline': 'Application Deadline',
+    'description': 'Job Description',
+}
+
+# 表头别名（小写比较），按名称而不是位置映射列
+HEADER_ALIASES = {
+    'title': ('job title', 'title', 'position', '职位', '职位名称', '岗位', '岗位名称'),
+    'company': ('company name', 'company', '公司', '公司名称', '企业名称'),
+    'city': ('work city', 'city', 'location', '城市', '工作城市', '工作地点'),
+    'salary': ('salary', '薪资', '薪酬', '工资'),
+    'deadline': ('application deadline', 'deadline', '截止日期', '申请截止日期'),
+    'description': ('job description', 'description', '职位描述', '岗位描述', '岗位职责'),
+}
+REQUIRED_FIELDS = ('title', 'company')
+
+# 在前几行中查找表头
+HEADER_SEARCH_ROWS = 10
+BATCH_SIZE = 1000
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+_background = set()
+
+
+@contextmanager
+def interprocess_lock(path, blocking=True):
+    """
+    Hold an exclusive lock shared by all threads and processes using the same lock file
+    :param path: Lock file
+    :param blocking: Wait for the lock; otherwise give up at once if it is held elsewhere
+    :return: Context manager yielding True if the lock was acquired
+    """
+    # Streamlit 的会话是同一进程内的线程，文件锁之外还需要线程锁
+    with _locks_guard:
+        thread_lock = _locks.setdefault(os.path.abspath(path), threading.Lock())
+    if not thread_lock.acquire(blocking):
+        yield False
+        return
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as f:
+            locked = True
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    locked = False
+            try:
+                yield locked
+            finally:
+                if fcntl is not None and locked:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        thread_lock.release()
+
+
+def start_background(key, target, *args):
+    """
+    Run target(*args) in a daemon thread unless a task with the same key is already running
+    :param key: Task identifier, e.g. the file the task writes
+    :param target: Function to run
+    :return: True if a thread was started
+    """
+    with _locks_guard:
+        if key in _background:
+            return False
+        _background.add(key)
+
+    def run():
+        try:
+            target(*args)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with _locks_guard:
+                _background.discard(key)
+
+    threading.Thread(target=run, name=f"offerai-{key}", daemon=True).start()
+    return True
+
+
+def default_sources():
+    """
+    :return: Absolute paths of the workbooks in the working directory
+    """
+    return sorted(os.path.abspath(path) for path in glob.glob(DEFAULT_SOURCES)
+                  if not os.path.basename(path).startswith(EXCEL_LOCK_PREFIX))
+
+
+def _normalize_header(value):
+    return str(value).strip().lower() if value is not None else ''
+
+
+def _map_headers(row):
+    """
+    Map a header row to catalog fields by name
+    :param row: Tuple of header cell values
+    :return: {field: column index}
+    """
+    lookup = {alias: field for field, aliases in HEADER_ALIASES.items() for alias in aliases}
+    mapping = {}
+    for index, value in enumerate(row):
+        field = lookup.get(_normalize_header(value))
+        if field and field not in mapping:
+            mapping[field] = index
+    return mapping
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _create_schema(conn):
+    conn.execute("""
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            company TEXT NOT NULL,
+            city TEXT NOT NULL DEFAULT '',
+            salary TEXT NOT NULL DEFAULT '',
+            deadline TEXT NOT NULL DEFAULT '',
+            description TEXT NOT NULL DEFAULT '',
+            source TEXT NOT NULL,
+            UNIQUE (title, company, city, salary, deadline)
+        )
+    """)
+    # 记录导入了哪些工作簿，用于判断目录是否过期
+    conn.execute("CREATE TABLE sources (path TEXT PRIMARY KEY, mtime REAL NOT NULL)")
+    conn.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+
+def _read_sources(db_path):
+    """
+    Read the workbooks a catalog was built from
+    :param db_path: Catalog database file
+    :return: (built from default sources, {path: mtime}), or None if there is no usable catalog
+    """
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            auto = conn.execute("SELECT value FROM info WHERE key = 'auto'").fetchone()
+            sources = dict(conn.execute("SELECT path, mtime FROM sources"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    if auto is None:
+        return None
+    return auto[0] == '1', sources
+
+
+def iter_sheet_rows(workbook):
+    """
+    Stream the job rows of every sheet in a workbook, closing it when done
+    :param workbook: Workbook opened with load_workbook(read_only=True)
+    :return: Generator of (sheet name, {field: text}) and, for skipped sheets, (sheet name, None)
+    """
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            mapping = None
+            for _, row in zip(range(HEADER_SEARCH_ROWS), rows):
+                candidate = _map_headers(row)
+                if all(field in candidate for field in REQUIRED_FIELDS):
+                    mapping = candidate
+                    break
+            if mapping is None:
+                yield sheet.title, None
+                continue
+
+            for row in rows:
+                yield sheet.title, {
+                    field: _cell_text(row[index]) if index < len(row) else ''
+                    for field, index in mapping.items()
+                }
+    finally:
+        workbook.close()
+
+
+def import_catalog(sources=None, db_path=CATALOG_DB):
+    """
+    Import job workbooks into the SQLite catalog, replacing its previous contents
+    :param sources: List of .xlsx files, defaults to every workbook in the working directory.
+                    A catalog built from explicit sources is not replaced by ensure_catalog()'s defaults.
+    :param db_path: Catalog database file
+    :return: Dictionary with imported, duplicate and invalid row counts and skipped sheets
+    """
+    with interprocess_lock(db_path + '.lock'):
+        return _import_catalog(sources, db_path)
+
+
+def _import_catalog(sources, db_path):
+    auto = sources is None
+    sources = default_sources() if auto else [os.path.abspath(path) for path in sources]
+
+    directory = os.path.dirname(db_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    # 先写入临时文件，完成后再替换，导入过程中页面仍可读取旧目录
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(db_path) + '.', suffix='.tmp')
+    os.close(fd)
+
+    stats = {"imported": 0, "duplicates": 0, "invalid": 0, "skipped_sheets": []}
+    fields = list(CATALOG_COLUMNS)
+    insert = (f"INSERT OR IGNORE INTO jobs ({', '.join(fields)}, source) "
+              f"VALUES ({', '.join('?' for _ in fields)}, ?)")
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        _create_schema(conn)
+        batch = []
+        for path in sources:
+            conn.execute("INSERT OR REPLACE INTO sources (path, mtime) VALUES (?, ?)",
+                         (path, os.path.getmtime(path) if os.path.exists(path) else 0))
+            try:
+                workbook = load_workbook(path, read_only=True, data_only=True)
+            except Exception as e:
+                stats["skipped_sheets"].append(f"{os.path.basename(path)}: {str(e)}")
+                continue
+            for sheet_name, job in iter_sheet_rows(workbook):
+                if job is None:
+                    stats["skipped_sheets"].append(f"{os.path.basename(path)}:{sheet_name}")
+                    continue
+                if not all(job.get(field) for field in REQUIRED_FIELDS):
+                    if any(job.values()):
+                        stats["invalid"] += 1
+                    continue
+                batch.append([job.get(field, '') for field in fields] + [f"{os.path.basename(path)}:{sheet_name}"])
+                if len(batch) >= BATCH_SIZE:
+                    _flush(conn, insert, batch, stats)
+        _flush(conn, insert, batch, stats)
+        conn.execute("INSERT INTO info (key, value) VALUES ('auto', ?)", ('1' if auto else '0',))
+        conn.execute("CREATE INDEX jobs_city ON jobs (city)")
+        conn.commit()
+    except BaseException:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+    return stats
+
+
+def _flush(conn, insert, batch, stats):
+    before = conn.total_changes
+    conn.executemany(insert, batch)
+    inserted = conn.total_changes - before
+    stats["imported"] += inserted
+    stats["duplicates"] += len(batch) - inserted
+    batch.clear()
+
+
+def _catalog_state(sources, db_path):
+    """
+    Compare the catalog with its source workbooks
+    :param sources: See ensure_catalog()
+    :param db_path: Catalog database file
+    :return: ('missing', 'stale' or 'current', sources argument for re-importing)
+    """
+    recorded = _read_sources(db_path)
+    if recorded is None:
+        return 'missing', sources
+
+    auto, recorded_sources = recorded
+    if sources is not None:
+        wanted, import_sources = {os.path.abspath(path) for path in sources}, sources
+    elif auto:
+        wanted, import_sources = set(default_sources()), None
+    else:
+        # 命令行导入的目录不会被当前目录下的工作簿覆盖
+        wanted, import_sources = set(recorded_sources), sorted(recorded_sources)
+
+    stale = wanted != set(recorded_sources) or any(
+        os.path.exists(path) and os.path.getmtime(path) != recorded_sources[path] for path in wanted
+    )
+    return ('stale' if stale else 'current'), import_sources
+
+
+def ensure_catalog(sources=None, db_path=CATALOG_DB):
+    """
+    Import the catalog if it is missing. If its source workbooks changed, re-import it in a
+    background thread and keep serving the current catalog until the new one replaces it.
+    :param sources: List of .xlsx files; by default the catalog's recorded sources if it was built
+                    from explicit files, otherwise every workbook in the working directory
+    :param db_path: Catalog database file
+    :return: Catalog database file
+    """
+    state, import_sources = _catalog_state(sources, db_path)
+    if state == 'missing':
+        # 在锁内再检查一次，同时打开页面的会话只会有一个执行导入
+        with interprocess_lock(db_path + '.lock'):
+            state, import_sources = _catalog_state(sources, db_path)
+            if state == 'missing':
+                _import_catalog(import_sources, db_path)
+    elif state == 'stale':
+        start_background(f"catalog:{os.path.abspath(db_path)}", _refresh_catalog, sources, db_path)
+    return db_path
+
+
+def _refresh_catalog(sources, db_path):
+    # 其他线程或进程正在导入时直接放弃，下一次检查时再决定是否需要导入
+    with interprocess_lock(db_path + '.lock', blocking=False) as locked:
+        if not locked:
+            return
+        state, import_sources = _catalog_state(sources, db_path)
+        if state != 'current':
+            _import_catalog(import_sources, db_path)
+
+
+if __name__ == "__main__":
+    # python catalog_import.py [workbook.xlsx ...]
+    result = import_catalog(sys.argv[1:] or None)
+    print(f"Imported {result['imported']} jobs "
+          f"({result['duplicates']} duplicates, {result['invalid']} invalid rows skipped)")
+    for skipped in result['skipped_sheets']:
+        print(f"Skipped: {skipped}")
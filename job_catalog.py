@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from catalog_import import CATALOG_COLUMNS, CATALOG_DB, ensure_catalog, interprocess_lock, start_background
+from job_queue import DATA_DIR
+
+# 每次目录导入生成一个快照目录，所有Streamlit进程通过mmap共享同一份文件
+SNAPSHOT_ROOT = os.path.join(DATA_DIR, 'snapshots')
+# 重复值多的列做字典编码，描述文本放在一个连续的缓冲区里
+CATEGORICAL_FIELDS = ('title', 'company', 'city', 'salary', 'deadline')
+TEXT_FIELD = 'description'
+BATCH_SIZE = 10000
+# 旧快照被替换后保留一段时间，给刚拿到旧路径、还没打开它的会话留出时间
+SNAPSHOT_GRACE = 600
+SUPERSEDED_MARKER = 'superseded'
+
+
+def _codes_dtype(n_categories):
+    # 与 pandas 为 Categorical 选择的编码类型一致，这样 from_codes 不会复制数组
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _load_array(path, dtype):
+    # 空文件无法mmap
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def build_snapshot(snapshot_dir, db_path=CATALOG_DB):
+    """
+    Write a dictionary-encoded, memory-mappable snapshot of the SQLite catalog
+    :param snapshot_dir: Output directory
+    :param db_path: Catalog database file
+    :return: snapshot_dir
+    """
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(snapshot_dir) or '.', suffix='.tmp')
+
+    interned = {field: {} for field in CATEGORICAL_FIELDS}
+    raw_codes = {field: open(os.path.join(tmp_dir, f'{field}.raw'), 'wb') for field in CATEGORICAL_FIELDS}
+    text_file = open(os.path.join(tmp_dir, f'{TEXT_FIELD}.bin'), 'wb')
+    offsets_file = open(os.path.join(tmp_dir, f'{TEXT_FIELD}.offsets'), 'wb')
+
+    rows_written = 0
+    position = 0
+    conn = sqlite3.connect(db_path)
+    try:
+        np.zeros(1, dtype=np.uint64).tofile(offsets_file)
+        cursor = conn.execute(f"SELECT {', '.join(CATEGORICAL_FIELDS)}, {TEXT_FIELD} FROM jobs ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            codes = {field: np.empty(len(rows), dtype=np.int32) for field in CATEGORICAL_FIELDS}
+            offsets = np.empty(len(rows), dtype=np.uint64)
+            for i, row in enumerate(rows):
+                for j, field in enumerate(CATEGORICAL_FIELDS):
+                    table = interned[field]
+                    codes[field][i] = table.setdefault(row[j], len(table))
+                data = row[-1].encode('utf-8')
+                text_file.write(data)
+                position += len(data)
+                offsets[i] = position
+            for field in CATEGORICAL_FIELDS:
+                codes[field].tofile(raw_codes[field])
+            offsets.tofile(offsets_file)
+            rows_written += len(rows)
+    finally:
+        conn.close()
+        for f in (*raw_codes.values(), text_file, offsets_file):
+            f.close()
+
+    # 类别数确定后，把 int32 编码分块转换为最小的整数类型
+    meta = {"rows": rows_written, "fields": {}}
+    for field in CATEGORICAL_FIELDS:
+        raw_path = os.path.join(tmp_dir, f'{field}.raw')
+        dtype = _codes_dtype(len(interned[field]))
+        raw = _load_array(raw_path, np.int32)
+        with open(os.path.join(tmp_dir, f'{field}.codes'), 'wb') as f:
+            for start in range(0, len(raw), BATCH_SIZE * 100):
+                raw[start:start + BATCH_SIZE * 100].astype(dtype).tofile(f)
+        del raw
+        os.remove(raw_path)
+        meta["fields"][field] = {"dtype": dtype.name, "categories": list(interned[field])}
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    try:
+        os.rename(tmp_dir, snapshot_dir)
+    except OSError:
+        # 另一个进程已经生成了同一个快照
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return snapshot_dir
+
+
+def ensure_snapshot(db_path=CATALOG_DB, snapshot_root=SNAPSHOT_ROOT):
+    """
+    Return the snapshot matching the catalog. Only the first snapshot is built synchronously;
+    when the catalog changes, the previous snapshot is served while the new one is built in the background.
+    :param db_path: Catalog database file
+    :param snapshot_root: Directory holding snapshots
+    :return: Snapshot directory
+    """
+    ensure_catalog(db_path=db_path)
+    os.makedirs(snapshot_root, exist_ok=True)
+    version = str(os.stat(db_path).st_mtime_ns)
+    snapshot_dir = os.path.join(snapshot_root, version)
+    if os.path.exists(os.path.join(snapshot_dir, 'meta.json')):
+        # 清理只是顺带做的，锁被占用时跳过
+        with interprocess_lock(snapshot_root + '.lock', blocking=False) as locked:
+            if locked:
+                _sweep_snapshots(snapshot_root, version)
+        return snapshot_dir
+
+    previous = _latest_snapshot(snapshot_root)
+    if previous is None:
+        return _update_snapshot(db_path, snapshot_root)
+    start_background(f"snapshot:{os.path.abspath(snapshot_root)}", _update_snapshot, db_path, snapshot_root)
+    return previous
+
+
+def _update_snapshot(db_path, snapshot_root):
+    """
+    Build the snapshot for the current catalog if it does not exist and sweep old ones
+    :return: Snapshot directory
+    """
+    with interprocess_lock(snapshot_root + '.lock'):
+        version = str(os.stat(db_path).st_mtime_ns)
+        snapshot_dir = os.path.join(snapshot_root, version)
+        if not os.path.exists(os.path.join(snapshot_dir, 'meta.json')):
+            build_snapshot(snapshot_dir, db_path)
+        _sweep_snapshots(snapshot_root, version)
+    return snapshot_dir
+
+
+def _latest_snapshot(snapshot_root):
+    """
+    :return: Newest complete snapshot directory, or None
+    """
+    versions = [name for name in os.listdir(snapshot_root)
+                if name.isdigit() and os.path.exists(os.path.join(snapshot_root, name, 'meta.json'))]
+    if not versions:
+        return None
+    return os.path.join(snapshot_root, max(versions, key=int))
+
+
+def _sweep_snapshots(snapshot_root, current):
+    """
+    Mark snapshots other than the current one as superseded and delete them once the grace period has passed
+    """
+    # 已经mmap旧快照的进程不受删除影响；宽限期保护的是还没来得及打开的会话
+    now = time.time()
+    for name in os.listdir(snapshot_root):
+        path = os.path.join(snapshot_root, name)
+        if name == current or not os.path.isdir(path):
+            continue
+        if name.endswith('.tmp'):
+            # 快照只在持有锁时生成，剩下的临时目录来自失败的构建
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        marker = os.path.join(path, SUPERSEDED_MARKER)
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+        elif now - os.path.getmtime(marker) > SNAPSHOT_GRACE:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class JobCatalog:
+    """
+    Read-only job catalog backed by a memory-mapped snapshot.
+    String columns are pandas Categoricals over mmap'ed codes; descriptions are decoded on demand.
+    """
+
+    def __init__(self, snapshot_dir):
+        """
+        :param snapshot_dir: Directory written by build_snapshot()
+        """
+        with open(os.path.join(snapshot_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.size = meta["rows"]
+        self._columns = {}
+        for field, info in meta["fields"].items():
+            codes = _load_array(os.path.join(snapshot_dir, f'{field}.codes'), np.dtype(info["dtype"]))
+            categories = pd.Index(info["categories"], dtype=object)
+            self._columns[field] = pd.Categorical.from_codes(codes, categories=categories)
+        self._text = _load_array(os.path.join(snapshot_dir, f'{TEXT_FIELD}.bin'), np.uint8)
+        self._offsets = _load_array(os.path.join(snapshot_dir, f'{TEXT_FIELD}.offsets'), np.uint64)
+
+    def __len__(self):
+        return self.size
+
+    def cities(self):
+        """
+        :return: Distinct work cities in order of first appearance
+        """
+        return list(self._columns['city'].categories)
+
+    def search(self, term='', city=None):
+        """
+        Find jobs whose title or company contains term, optionally in one city
+        :param term: Case-insensitive substring, empty matches everything
+        :param city: Work city, None matches every city
+        :return: Array of matching row numbers
+        """
+        mask = np.ones(self.size, dtype=bool)
+        if term:
+            # 只在去重后的类别上做字符串匹配，再按编码映射回每一行
+            term_mask = np.zeros(self.size, dtype=bool)
+            for field in ('title', 'company'):
+                column = self._columns[field]
+                matches = np.asarray(column.categories.str.contains(term, case=False, regex=False))
+                term_mask |= matches[column.codes]
+            mask &= term_mask
+        if city is not None:
+            column = self._columns['city']
+            code = column.categories.get_indexer([city])[0]
+            mask &= column.codes == code
+        return np.flatnonzero(mask)
+
+    def description(self, i):
+        """
+        :param i: Row number
+        :return: Job description text
+        """
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return bytes(self._text[start:end]).decode('utf-8')
+
+    def row(self, i):
+        """
+        :param i: Row number
+        :return: Job dictionary keyed by display column name
+        """
+        job = {CATALOG_COLUMNS[field]: column[i] for field, column in self._columns.items()}
+        job[CATALOG_COLUMNS[TEXT_FIELD]] = self.description(i)
+        return job
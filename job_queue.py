@@ -0,0 +1,276 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+# 本地数据目录（clean_workspace 只清理当前目录下的 .txt/.pdf，不会影响这里）
+DATA_DIR = '.offerai'
+QUEUE_DB = os.path.join(DATA_DIR, 'jobs.db')
+
+# 可通过环境变量调整
+DEFAULT_WORKERS = int(os.environ.get('OFFERAI_WORKERS', 2))
+DEFAULT_PER_USER_LIMIT = int(os.environ.get('OFFERAI_MAX_JOBS_PER_USER', 1))
+DEFAULT_RETENTION = int(os.environ.get('OFFERAI_JOB_RETENTION', 3600))
+DEFAULT_MAX_RETRIES = int(os.environ.get('OFFERAI_JOB_MAX_RETRIES', 5))
+# 运行中的任务需要定期续租；租约过期说明工作进程已经退出，任务重新排队
+DEFAULT_LEASE = float(os.environ.get('OFFERAI_JOB_LEASE', 60))
+
+PENDING_STATUSES = ('queued', 'running')
+# 已达到并发上限的用户，参数为 per_user_limit
+BUSY_OWNERS = "SELECT owner FROM jobs WHERE status = 'running' GROUP BY owner HAVING COUNT(*) >= ?"
+
+
+class RetryLater(Exception):
+    """
+    Raised by a job handler to put the job back in the queue, e.g. when the upstream rate-limits us
+    """
+
+    def __init__(self, delay, result):
+        """
+        :param delay: Seconds to wait before the job is worked again
+        :param result: Result to store if the job has no retries left
+        """
+        super().__init__(f"retry in {delay:.0f}s")
+        self.delay = delay
+        self.result = result
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue worked by a pool of background threads.
+    Jobs survive browser refreshes. A running job holds a lease renewed by its queue's
+    heartbeat thread and is re-queued only after the lease expires, i.e. its process died.
+    """
+
+    def __init__(self, handler, db_path=QUEUE_DB, workers=DEFAULT_WORKERS,
+                 per_user_limit=DEFAULT_PER_USER_LIMIT, retention=DEFAULT_RETENTION,
+                 max_retries=DEFAULT_MAX_RETRIES, lease=DEFAULT_LEASE):
+        """
+        :param handler: Callable taking a job payload dict and returning a JSON-serializable result
+        :param db_path: SQLite database file
+        :param workers: Number of worker threads
+        :param per_user_limit: Maximum number of jobs running at once for one owner
+        :param retention: Seconds to keep finished jobs before purging them
+        :param max_retries: How many times a job may be deferred with RetryLater
+        :param lease: Seconds a running job stays claimed without a heartbeat
+        """
+        self.handler = handler
+        self.db_path = db_path
+        self.workers = workers
+        self.per_user_limit = per_user_limit
+        self.retention = retention
+        self.max_retries = max_retries
+        self.lease = lease
+        # 标识本实例认领的任务，用于续租和完成时校验
+        self.worker_id = uuid.uuid4().hex
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    created_at REAL NOT NULL,
+                    run_after REAL NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_until REAL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in (('run_after', 'REAL NOT NULL DEFAULT 0'),
+                                     ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+                                     ('worker', 'TEXT'),
+                                     ('lease_until', 'REAL')):
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return _Transaction(conn)
+
+    def start(self):
+        """
+        Start the worker threads (idempotent)
+        """
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"offerai-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="offerai-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        """
+        Ask the worker threads to exit after their current job
+        """
+        self._stop.set()
+        self._wakeup.set()
+
+    def submit(self, owner, payload, delay=0):
+        """
+        Enqueue a job; jobs are worked in submission order
+        :param owner: Identifier of the submitting user, used for the concurrency limit
+        :param payload: JSON-serializable job input
+        :param delay: Seconds before the job becomes eligible to run
+        :return: Job ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, owner, status, payload, created_at, run_after) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, owner, json.dumps(payload), now, now + delay)
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Look up a job
+        :param job_id: Job ID returned by submit()
+        :return: Job dictionary with status, payload, result, queue position (eligible jobs ahead of it)
+                 and blocked (its owner is at the concurrent job limit), or None if unknown/purged
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            job['payload'] = json.loads(job['payload'])
+            job['result'] = json.loads(job['result']) if job['result'] else None
+            job['position'] = 0
+            job['blocked'] = False
+            if job['status'] == 'queued':
+                job['blocked'] = conn.execute(
+                    f"SELECT 1 FROM ({BUSY_OWNERS}) WHERE owner = ?", (self.per_user_limit, job['owner'])
+                ).fetchone() is not None
+                # 只计算现在就能运行的任务：延后执行的任务和被并发上限挡住的用户的任务不会排在前面
+                job['position'] = conn.execute(
+                    f"SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ? AND run_after <= ? "
+                    f"AND owner NOT IN ({BUSY_OWNERS})",
+                    (job['created_at'], now, self.per_user_limit)
+                ).fetchone()[0]
+        return job
+
+    def _claim(self):
+        """
+        Atomically move the next eligible job from queued to running
+        :return: (job_id, attempt number, payload) or None if nothing can run right now
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # 租约过期的任务（工作进程已退出）重新排队
+            conn.execute("UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, started_at = NULL "
+                         "WHERE status = 'running' AND lease_until < ?", (now,))
+            row = conn.execute(f"""
+                SELECT id, attempts, payload FROM jobs
+                WHERE status = 'queued' AND run_after <= ? AND owner NOT IN ({BUSY_OWNERS})
+                ORDER BY created_at
+                LIMIT 1
+            """, (now, self.per_user_limit)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, started_at = ?, "
+                         "attempts = attempts + 1 WHERE id = ?",
+                         (self.worker_id, now + self.lease, now, row['id']))
+        return row['id'], row['attempts'] + 1, json.loads(row['payload'])
+
+    def _finish(self, job_id, status, result):
+        # 只有仍持有租约的实例才能写入结果
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_until = NULL "
+                         "WHERE id = ? AND status = 'running' AND worker = ?",
+                         (status, json.dumps(result), time.time(), job_id, self.worker_id))
+        # 任务结束后同一用户的下一个任务可能可以运行了
+        self._wakeup.set()
+
+    def _defer(self, job_id, delay):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, started_at = NULL, "
+                         "run_after = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                         (time.time() + delay, job_id, self.worker_id))
+
+    def _heartbeat(self):
+        # 为本实例正在运行的任务续租
+        while not self._stop.wait(self.lease / 3):
+            try:
+                with self._connect() as conn:
+                    conn.execute("UPDATE jobs SET lease_until = ? WHERE status = 'running' AND worker = ?",
+                                 (time.time() + self.lease, self.worker_id))
+            except sqlite3.Error:
+                traceback.print_exc()
+
+    def purge(self):
+        """
+        Delete finished jobs older than the retention period
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE status NOT IN (?, ?) AND finished_at < ?",
+                         (*PENDING_STATUSES, time.time() - self.retention))
+
+    def _work(self):
+        last_purge = 0
+        while not self._stop.is_set():
+            if time.time() - last_purge > 60:
+                self.purge()
+                last_purge = time.time()
+
+            claimed = self._claim()
+            if claimed is None:
+                self._wakeup.wait(timeout=1)
+                self._wakeup.clear()
+                continue
+
+            job_id, attempts, payload = claimed
+            try:
+                self._finish(job_id, 'done', self.handler(payload))
+            except RetryLater as e:
+                if attempts > self.max_retries:
+                    self._finish(job_id, 'done', e.result)
+                else:
+                    self._defer(job_id, e.delay)
+            except Exception as e:
+                traceback.print_exc()
+                self._finish(job_id, 'failed', {"status": "error", "message": f"Unexpected error: {str(e)}"})
+
+
+class _Transaction:
+    """
+    Context manager that commits or rolls back any open transaction and closes the connection
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
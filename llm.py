@@ -2,9 +2,23 @@ import requests
 import json
 import os
 import toml
+import traceback
 import streamlit as st
 from fpdf import FPDF
-import textwrap
+from resume_parser import ParsedResume, ResumeSection, parse_resume
+from job_queue import RetryLater
+from rate_limit import record_usage
+from profiling import stage
+
+# OpenRouter 请求的连接/读取超时（秒），超时后走模板兜底
+REQUEST_TIMEOUT = (float(os.environ.get('OFFERAI_LLM_CONNECT_TIMEOUT', 10)),
+                   float(os.environ.get('OFFERAI_LLM_READ_TIMEOUT', 60)))
+
+# 上游返回429但没有Retry-After时的等待秒数
+DEFAULT_RETRY_AFTER = 30
+
+# 表单提示用户对缺失的部分填写 'null'
+EMPTY_FIELD_VALUES = {'', 'null', 'none', 'n/a', 'na', '无'}
 
 
 def load_api_key():
@@ -17,10 +31,24 @@ def load_api_key():
     return secrets['OPENROUTER']['OPENROUTER_API_KEY']
 
 
-def generate_resume(user_data):
+def _retry_after(response):
+    """
+    Read the Retry-After header of a rate-limited response
+    :param response: requests.Response
+    :return: Seconds to wait
+    """
+    try:
+        return max(float(response.headers.get('Retry-After', DEFAULT_RETRY_AFTER)), 1)
+    except ValueError:
+        return DEFAULT_RETRY_AFTER
+
+
+def generate_resume(user_data, session=None, ip=None):
     """
     Generate AI resume
     :param user_data: User input information dictionary
+    :param session: Session/user identifier the token usage is recorded against
+    :param ip: Client IP address the token usage is recorded against
     :return: Generated resume content
     """
     OPENROUTER_API_KEY = load_api_key()
@@ -87,9 +115,18 @@ def generate_resume(user_data):
             data=json.dumps({
                 "messages": messages,
                 "model": "openai/gpt-4o-mini-2024-07-18"
-            })
+            }),
+            timeout=REQUEST_TIMEOUT
         )
 
+        # 上游限流时返回等待时间，由调用方决定是否稍后重试
+        if response.status_code == 429:
+            return {
+                "status": "error",
+                "message": "API rate limit reached, please try again later",
+                "retry_after": _retry_after(response)
+            }
+
         # Check response status
         response.raise_for_status()
 
@@ -97,11 +134,6 @@ def generate_resume(user_data):
         result = response.json()
         resume_content = result['choices'][0]['message']['content']
 
-        return {
-            "status": "success",
-            "content": resume_content
-        }
-
     except requests.exceptions.RequestException as e:
         return {
             "status": "error",
@@ -118,6 +150,18 @@ def generate_resume(user_data):
             "message": f"Unexpected error: {str(e)}"
         }
 
+    # 用量记录失败不能影响已经生成的简历
+    try:
+        record_usage('completion', OPENROUTER_API_KEY, session=session, ip=ip,
+                     tokens=(result.get('usage') or {}).get('total_tokens', 0))
+    except Exception:
+        traceback.print_exc()
+
+    return {
+        "status": "success",
+        "content": resume_content
+    }
+
 
 def format_resume(resume_content):
     """
@@ -125,15 +169,67 @@ def format_resume(resume_content):
     :param resume_content: Raw content from AI-generated resume
     :return: Formatted resume content
     """
-    if resume_content.startswith('```'):
-        resume_content = resume_content[3:]
-    if resume_content.endswith('```'):
-        resume_content = resume_content[:-3]
+    return parse_resume(resume_content).to_markdown()
+
+
+def _field_lines(value):
+    """
+    Split a free-text form field into non-empty lines
+    :param value: Raw field value
+    :return: List of stripped lines, empty if the field is missing or 'null'
+    """
+    value = (value or '').strip()
+    if value.lower() in EMPTY_FIELD_VALUES:
+        return []
+    lines = []
+    for line in value.splitlines():
+        line = line.strip().lstrip('-*•').strip()
+        if line and line.lower() not in EMPTY_FIELD_VALUES:
+            lines.append(line)
+    return lines
+
+
+def build_resume_template(user_data):
+    """
+    Build a resume locally from user input without calling the LLM
+    :param user_data: User input information dictionary
+    :return: ParsedResume
+    """
+    contact = [user_data.get(field, '').strip() for field in ('city', 'email', 'phone')]
+    education = ' | '.join(part for part in (user_data.get('university', '').strip(),
+                                             user_data.get('degree', '').strip()) if part)
+    target_position = user_data.get('target_position', '').strip()
+    # 与 LLM 提示词一致，主修课程放在教育经历下
+    courses = _field_lines(user_data.get('major_courses'))
+
+    sections = [
+        ('Education', ([('text', education)] if education else []) +
+                      ([('bullet', f"Major Courses: {', '.join(courses)}")] if courses else [])),
+        ('Work Experience', [('bullet', line) for line in _field_lines(user_data.get('work_experience'))]),
+        ('Project Experience', [('bullet', line) for line in _field_lines(user_data.get('project_experience'))]),
+        ('Honors & Awards', [('bullet', line) for line in _field_lines(user_data.get('honors_won'))]),
+    ]
 
-    formatted_content = resume_content.replace('---', '\n')
-    formatted_content = formatted_content.replace('###', '##')
-    formatted_content = '\n\n'.join(line.strip() for line in formatted_content.splitlines() if line.strip())
-    return formatted_content
+    resume = ParsedResume()
+    resume.contact = ' | '.join(part for part in contact if part) or None
+    if target_position:
+        resume.preamble.lines.append(('text', f'Target Position: {target_position}'))
+    for title, lines in sections:
+        if not lines:
+            continue
+        section = ResumeSection(title)
+        section.lines = lines
+        resume.sections.append(section)
+    return resume
+
+
+def render_resume_template(user_data):
+    """
+    Render a resume locally from user input without calling the LLM
+    :param user_data: User input information dictionary
+    :return: Resume content in the same Markdown layout as format_resume()
+    """
+    return build_resume_template(user_data).to_markdown()
 
 
 def validate_user_input(user_data):
@@ -177,11 +273,15 @@ def save_resume_to_file(content, filename):
         return False
 
 
-def process_resume_request(user_data):
+def process_resume_request(user_data, fallback_to_template=True, defer_on_rate_limit=False, session=None, ip=None):
     """
     Main function to process resume generation request
     :param user_data: User input data
-    :return: Processing result
+    :param fallback_to_template: Return the locally rendered resume if the LLM request fails
+    :param defer_on_rate_limit: Raise RetryLater when the upstream rate-limits us, for use as a job queue handler
+    :param session: Session/user identifier for usage accounting
+    :param ip: Client IP address for usage accounting
+    :return: Processing result; on success "content" is the Markdown and "resume" the parsed sections
     """
     is_valid, error_message = validate_user_input(user_data)
     if not is_valid:
@@ -190,19 +290,45 @@ def process_resume_request(user_data):
             "message": error_message
         }
 
-    result = generate_resume(user_data)
+    with stage('generate_resume'):
+        result = generate_resume(user_data, session=session, ip=ip)
     if result["status"] == "success":
-        formatted_resume = format_resume(result["content"])
+        # 只解析一次，Markdown 显示和 PDF 都使用同一份结构
+        with stage('format_resume'):
+            resume = parse_resume(result["content"])
         return {
             "status": "success",
-            "content": formatted_resume
+            "source": "llm",
+            "content": resume.to_markdown(),
+            "resume": resume.to_dict()
         }
-    else:
-        return result
+
+    retry_after = result.pop("retry_after", None)
+    if fallback_to_template:
+        resume = build_resume_template(user_data)
+        result = {
+            "status": "success",
+            "source": "template",
+            "content": resume.to_markdown(),
+            "resume": resume.to_dict(),
+            "message": result["message"]
+        }
+    # 被限流时让任务重新排队；重试次数用完后才返回模板结果
+    if defer_on_rate_limit and retry_after:
+        raise RetryLater(retry_after, result)
+    return result
 
 
 def save_resume_to_pdf(content, filename, name):
+    """
+    Render resume to PDF
+    :param content: Resume Markdown or ParsedResume
+    :param filename: Output PDF file name
+    :param name: Name shown in the title
+    """
     try:
+        resume = content if isinstance(content, ParsedResume) else parse_resume(content)
+
         pdf = FPDF()
         pdf.add_page()
 
@@ -212,25 +338,25 @@ def save_resume_to_pdf(content, filename, name):
         pdf.set_font('DejaVuB', '', 16)
         pdf.cell(0, 10, f'{name}\'s Resume', 0, 1, 'C')
         # 添加联系方式并居中
-        contact_info = content.splitlines()[0]  # 假设第一行是联系方式
         pdf.set_font('DejaVu', '', 12)
-        pdf.cell(0, 10, contact_info, 0, 1, 'C')
+        if resume.contact:
+            pdf.cell(0, 10, resume.contact, 0, 1, 'C')
         pdf.ln(2)
 
-        lines = content.split('\n')[1:]
-        for line in lines:
-            if '**' in line:
+        for section in resume:
+            if section.title is not None:
                 pdf.set_font('DejaVuB', '', 14)
-                line = line.replace('**', '')
-                pdf.cell(0, 10, line.strip(), 0, 1, 'L')
+                pdf.cell(0, 10, section.title, 0, 1, 'L')
                 pdf.set_font('DejaVu', '', 12)
-            else:
-                wrapped_lines = textwrap.wrap(line, width=85)
-                for wrapped_line in wrapped_lines:
-                    pdf.cell(0, 6, wrapped_line, 0, 1, 'L')
-
-                if not line.strip():
-                    pdf.ln(2)
+            for kind, text in section.lines:
+                if kind == 'bullet':
+                    text = f'- {text}'
+                elif kind == 'subheader':
+                    pdf.set_font('DejaVuB', '', 12)
+                # multi_cell 按实际字宽自动换行
+                pdf.multi_cell(0, 6, text.replace('**', ''), 0, 'L')
+                pdf.set_font('DejaVu', '', 12)
+                pdf.ln(2)
 
         pdf.output(filename)
         return True
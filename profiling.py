@@ -0,0 +1,206 @@
+import collections
+import cProfile
+import hmac
+import ipaddress
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from job_queue import DATA_DIR
+
+TRACE_DIR = os.path.join(DATA_DIR, 'traces')
+
+# OFFERAI_PROFILE=1 对所有请求开启性能分析；也可以在侧边栏按会话开启
+PROFILE_ENABLED = os.environ.get('OFFERAI_PROFILE') == '1'
+# 设置 OFFERAI_ADMIN_PASSWORD 后，输入该密码的会话才能看到侧边栏开关和 Profiling 管理页面；
+# 未设置时只有直接从本机访问的会话可以看到
+ADMIN_PASSWORD = os.environ.get('OFFERAI_ADMIN_PASSWORD')
+SLOW_THRESHOLD_MS = float(os.environ.get('OFFERAI_SLOW_MS', 2000))
+MAX_TRACES = int(os.environ.get('OFFERAI_MAX_TRACES', 200))
+SAMPLE_INTERVAL = 0.005
+
+# Python 3.12+ 的 cProfile 基于 sys.monitoring，对整个解释器生效，会记录到其他线程的调用
+CPROFILE_IS_GLOBAL = sys.version_info >= (3, 12)
+
+_local = threading.local()
+_active = set()
+_active_lock = threading.Lock()
+
+
+def check_admin_password(password):
+    """
+    :param password: Password entered by the user
+    :return: True if admin access is configured and the password matches
+    """
+    if not ADMIN_PASSWORD or not password:
+        return False
+    return hmac.compare_digest(password.encode('utf-8'), ADMIN_PASSWORD.encode('utf-8'))
+
+
+def is_local_client(remote_addr, forwarded=False):
+    """
+    :param remote_addr: Address of the peer connected to Streamlit; Streamlit reports None for localhost
+    :param forwarded: The request carries proxy headers such as X-Forwarded-For
+    :return: True if the request comes straight from this machine rather than through a proxy
+    """
+    # 本机的反向代理转发的请求同样来自回环地址，带有转发头时不视为本机访问
+    if forwarded:
+        return False
+    if remote_addr is None:
+        return True
+    try:
+        return ipaddress.ip_address(remote_addr).is_loopback
+    except ValueError:
+        return False
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a named stage of the current profiled request; does nothing when no profiler is active
+    :param name: Stage name, e.g. 'job_list_page'
+    """
+    profiler = getattr(_local, 'profiler', None)
+    if profiler is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.stages.append((name, (time.perf_counter() - start) * 1000))
+
+
+class RequestProfiler:
+    """
+    Profile one Streamlit rerun or background job with cProfile and a stack sampler.
+    If the request takes longer than the threshold, the profile, the sampled stacks
+    and the stage timings are written to TRACE_DIR.
+
+    On Python 3.12+ cProfile sees every thread, so the .prof file is only written when no
+    other profiled request overlapped this one. Work from unprofiled threads (other sessions,
+    queue workers) can still appear in it; the sampled .folded stacks are always per-thread.
+    """
+
+    def __init__(self, name, enabled=PROFILE_ENABLED, threshold_ms=SLOW_THRESHOLD_MS, trace_dir=TRACE_DIR):
+        """
+        :param name: Request name, used in trace file names
+        :param enabled: Profile this request
+        :param threshold_ms: Only keep traces of requests slower than this
+        :param trace_dir: Directory for trace files
+        """
+        self.name = name
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self.trace_dir = trace_dir
+        self.stages = []
+        self.samples = collections.Counter()
+        self._profile = None
+        self._overlapped = False
+        self._sampler = None
+        self._done = threading.Event()
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        _local.profiler = self
+        self._thread_id = threading.get_ident()
+        with _active_lock:
+            _active.add(self)
+            if len(_active) > 1:
+                for profiler in _active:
+                    profiler._overlapped = True
+        self._sampler = threading.Thread(target=self._sample, name="offerai-sampler", daemon=True)
+        self._sampler.start()
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Python 3.12+ 同一时间只允许一个 cProfile，其他会话仍有采样结果
+            self._profile = None
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        total_ms = (time.perf_counter() - self._start) * 1000
+        if self._profile is not None:
+            self._profile.disable()
+        self._done.set()
+        self._sampler.join()
+        _local.profiler = None
+        with _active_lock:
+            _active.discard(self)
+
+        if total_ms >= self.threshold_ms:
+            self._dump(total_ms)
+        return False
+
+    def _sample(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def _dump(self, total_ms):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        trace_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.name}-{uuid.uuid4().hex[:6]}"
+        base = os.path.join(self.trace_dir, trace_id)
+
+        # 与其他请求重叠时，全局的 cProfile 结果无法归属到这一次请求
+        if self._profile is not None and not (CPROFILE_IS_GLOBAL and self._overlapped):
+            self._profile.dump_stats(base + '.prof')
+        # 折叠栈格式，可直接用于 flamegraph.pl / speedscope
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.items():
+                f.write(f"{stack} {count}\n")
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                "id": trace_id,
+                "name": self.name,
+                "timestamp": time.time(),
+                "total_ms": total_ms,
+                "stages": self.stages,
+            }, f)
+        prune_traces(self.trace_dir)
+
+
+def prune_traces(trace_dir=TRACE_DIR, keep=MAX_TRACES):
+    """
+    Delete all but the newest traces
+    :param trace_dir: Directory for trace files
+    :param keep: Number of traces to keep
+    """
+    for trace in list_traces(trace_dir)[keep:]:
+        for ext in ('.json', '.prof', '.folded'):
+            path = os.path.join(trace_dir, trace["id"] + ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def list_traces(trace_dir=TRACE_DIR):
+    """
+    :param trace_dir: Directory for trace files
+    :return: Trace summaries, newest first
+    """
+    if not os.path.isdir(trace_dir):
+        return []
+    traces = []
+    for filename in os.listdir(trace_dir):
+        if filename.endswith('.json'):
+            try:
+                with open(os.path.join(trace_dir, filename), encoding='utf-8') as f:
+                    traces.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return sorted(traces, key=lambda trace: trace["timestamp"], reverse=True)
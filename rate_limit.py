@@ -0,0 +1,202 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+from job_queue import DATA_DIR
+
+USAGE_DB = os.path.join(DATA_DIR, 'usage.db')
+
+
+def _parse_quota(value, default):
+    # 格式为 "次数/秒数"，例如 "5/600" 表示每10分钟5次
+    if not value:
+        return default
+    count, seconds = value.split('/')
+    return int(count), float(seconds)
+
+
+# 每个范围的令牌桶：(容量, 补满所需秒数)
+DEFAULT_QUOTAS = {
+    'session': _parse_quota(os.environ.get('OFFERAI_SESSION_QUOTA'), (5, 600)),
+    'ip': _parse_quota(os.environ.get('OFFERAI_IP_QUOTA'), (20, 600)),
+    'global': _parse_quota(os.environ.get('OFFERAI_GLOBAL_QUOTA'), (120, 60)),
+}
+# 超过这个等待时间就直接拒绝，而不是排队
+DEFAULT_MAX_WAIT = float(os.environ.get('OFFERAI_MAX_QUOTA_WAIT', 600))
+# 用量记录保留天数
+USAGE_RETENTION_DAYS = float(os.environ.get('OFFERAI_USAGE_RETENTION_DAYS', 30))
+# 清理过期令牌桶和用量记录的最小间隔（秒）
+PRUNE_INTERVAL = 60
+# 应用前面可信反向代理的层数；为0时忽略客户端可以伪造的 X-Forwarded-For
+TRUSTED_PROXIES = int(os.environ.get('OFFERAI_TRUSTED_PROXIES', 0))
+
+
+def client_ip(remote_addr, forwarded_for=None, trusted_proxies=TRUSTED_PROXIES):
+    """
+    Determine the client address for the per-IP bucket
+    :param remote_addr: Address of the peer connected to Streamlit
+    :param forwarded_for: X-Forwarded-For header value
+    :param trusted_proxies: Number of reverse proxies in front of the app that append to X-Forwarded-For
+    :return: Client IP address, or None if unknown
+    """
+    if not trusted_proxies or not forwarded_for:
+        return remote_addr
+    # 从右往左跳过可信代理添加的地址，左边的部分客户端可以随意伪造
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    if remote_addr:
+        hops.append(remote_addr)
+    if len(hops) <= trusted_proxies:
+        return remote_addr
+    return hops[-(trusted_proxies + 1)]
+
+
+def api_key_fingerprint(api_key):
+    """
+    Identify an API key in usage records without storing the key itself
+    :param api_key: API key
+    :return: Short hex digest
+    """
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def _connect(db_path):
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usage (
+            ts REAL NOT NULL,
+            api_key TEXT NOT NULL,
+            session TEXT,
+            ip TEXT,
+            event TEXT NOT NULL,
+            tokens INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+    return conn
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter with per-session, per-IP and global buckets.
+    Bucket state lives in SQLite so all Streamlit processes share it.
+    Requests over quota reserve a future token and are told how long to wait instead of failing.
+    """
+
+    def __init__(self, db_path=USAGE_DB, quotas=None, max_wait=DEFAULT_MAX_WAIT,
+                 usage_retention_days=USAGE_RETENTION_DAYS):
+        """
+        :param db_path: SQLite database file
+        :param quotas: {scope: (capacity, refill seconds)} for 'session', 'ip' and 'global'
+        :param max_wait: Longest delay (seconds) a request may be queued for before it is rejected
+        :param usage_retention_days: Days to keep usage records
+        """
+        self.db_path = db_path
+        self.quotas = quotas or DEFAULT_QUOTAS
+        self.max_wait = max_wait
+        self.usage_retention_days = usage_retention_days
+        self._last_prune = 0
+
+    def prune(self, now=None):
+        """
+        Delete idle buckets and usage records past the retention window
+        :param now: Current Unix timestamp
+        """
+        now = time.time() if now is None else now
+        conn = _connect(self.db_path)
+        try:
+            # 令牌最多预约到 -max_wait*rate，闲置超过补满时间+max_wait 的桶必然已满，删除后等价于新建
+            for scope, prefix in (('session', 'session:'), ('ip', 'ip:')):
+                period = self.quotas[scope][1]
+                conn.execute("DELETE FROM buckets WHERE key LIKE ? AND updated_at < ?",
+                             (prefix + '%', now - period - self.max_wait))
+            conn.execute("DELETE FROM usage WHERE ts < ?", (now - self.usage_retention_days * 86400,))
+        finally:
+            conn.close()
+
+    def acquire(self, session_id, ip=None):
+        """
+        Take one token from every applicable bucket
+        :param session_id: Session/user identifier
+        :param ip: Client IP address, if known
+        :return: Seconds to wait before running the request, or None if the wait exceeds max_wait
+        """
+        keys = [('session', f'session:{session_id}'), ('global', 'global')]
+        if ip:
+            keys.append(('ip', f'ip:{ip}'))
+
+        now = time.time()
+        if now - self._last_prune > PRUNE_INTERVAL:
+            self._last_prune = now
+            self.prune(now)
+
+        conn = _connect(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            wait = 0.0
+            updates = []
+            for scope, key in keys:
+                capacity, period = self.quotas[scope]
+                rate = capacity / period
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                # 允许令牌数为负：相当于预约未来的令牌
+                tokens -= 1
+                wait = max(wait, -tokens / rate)
+                updates.append((key, tokens, now))
+
+            if wait > self.max_wait:
+                conn.execute("ROLLBACK")
+                return None
+            conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", updates)
+            conn.execute("COMMIT")
+            return wait
+        finally:
+            conn.close()
+
+
+def record_usage(event, api_key, session=None, ip=None, tokens=0, db_path=USAGE_DB):
+    """
+    Append a usage record
+    :param event: Event name, e.g. 'request' or 'completion'
+    :param api_key: API key the usage is billed to
+    :param session: Session/user identifier
+    :param ip: Client IP address
+    :param tokens: LLM tokens consumed
+    """
+    conn = _connect(db_path)
+    try:
+        conn.execute("INSERT INTO usage (ts, api_key, session, ip, event, tokens) VALUES (?, ?, ?, ?, ?, ?)",
+                     (time.time(), api_key_fingerprint(api_key), session, ip, event, tokens))
+    finally:
+        conn.close()
+
+
+def usage_summary(since=0, by_session=False, db_path=USAGE_DB):
+    """
+    Summarise usage per API key and event, optionally also per session and IP
+    :param since: Only count records after this Unix timestamp
+    :param by_session: Also group by session and IP
+    :return: List of (api_key fingerprint, [session, ip,] event, count, tokens) tuples
+    """
+    group = "api_key, session, ip, event" if by_session else "api_key, event"
+    conn = _connect(db_path)
+    try:
+        return conn.execute(
+            f"SELECT {group}, COUNT(*), SUM(tokens) FROM usage WHERE ts >= ? "
+            f"GROUP BY {group} ORDER BY {group}",
+            (since,)
+        ).fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,182 @@
+import re
+
+# **Education** / **Education:** 形式的分节标题
+BOLD_HEADER_RE = re.compile(r'^\*\*([^*]+?)\*\*:?$')
+# Markdown 标题：一级、二级作为分节标题，三级及以下作为小标题
+HEADING_RE = re.compile(r'^(#{1,6})\s*(.*?)\s*#*$')
+BULLET_RE = re.compile(r'^[-*•+]\s+(.*)$')
+RULE_RE = re.compile(r'^[-*_=\s]{3,}$')
+# 标题为这些的分节（小写比较），其中的联系方式行提取为 contact
+CONTACT_TITLES = ('contact information', 'contact', 'contact info', '联系方式', '联系信息')
+
+
+class ResumeSection:
+    """
+    One resume section: a title and its lines as (kind, text) tuples,
+    where kind is 'text', 'bullet' or 'subheader'
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.lines = []
+
+    def __repr__(self):
+        return f"ResumeSection({self.title!r}, {self.lines!r})"
+
+
+class ParsedResume:
+    """
+    Resume structure produced by ResumeParser
+    """
+
+    def __init__(self):
+        self.contact = None
+        # 第一个分节标题之前、联系方式之外的行
+        self.preamble = ResumeSection(None)
+        self.sections = []
+
+    def __iter__(self):
+        if self.preamble.lines:
+            yield self.preamble
+        yield from self.sections
+
+    def to_markdown(self):
+        """
+        Render the resume as Markdown with one blank line between lines
+        :return: Markdown string
+        """
+        out = []
+        if self.contact:
+            out.append(self.contact)
+        for section in self:
+            if section.title is not None:
+                out.append(f'**{section.title}**')
+            for kind, text in section.lines:
+                if kind == 'bullet':
+                    out.append(f'- {text}')
+                elif kind == 'subheader':
+                    out.append(f'### {text}')
+                else:
+                    out.append(text)
+        return '\n\n'.join(out)
+
+    def to_dict(self):
+        """
+        :return: JSON-serializable form, e.g. for storing in a job result
+        """
+        return {
+            "contact": self.contact,
+            "sections": [{"title": section.title, "lines": section.lines}
+                         for section in [self.preamble, *self.sections]],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: Dictionary produced by to_dict()
+        :return: ParsedResume
+        """
+        resume = cls()
+        resume.contact = data["contact"]
+        preamble, *sections = data["sections"]
+        resume.preamble.lines = [tuple(line) for line in preamble["lines"]]
+        for item in sections:
+            section = ResumeSection(item["title"])
+            section.lines = [tuple(line) for line in item["lines"]]
+            resume.sections.append(section)
+        return resume
+
+
+class ResumeParser:
+    """
+    Incremental parser for LLM-generated resume Markdown.
+    Text can be fed in arbitrary chunks; every line is inspected exactly once.
+    """
+
+    def __init__(self):
+        self.resume = ParsedResume()
+        self._current = self.resume.preamble
+        # 联系方式分节只有在联系方式之外还有其他内容时才保留
+        self._contact_section = None
+        self._pending = []
+
+    def feed(self, chunk):
+        """
+        Feed the next piece of text
+        :param chunk: Arbitrary slice of the resume text
+        """
+        if '\n' not in chunk:
+            self._pending.append(chunk)
+            return
+        head, *lines, tail = chunk.split('\n')
+        self._pending.append(head)
+        self._parse_line(''.join(self._pending))
+        for line in lines:
+            self._parse_line(line)
+        self._pending = [tail]
+
+    def close(self):
+        """
+        Flush any buffered text
+        :return: ParsedResume
+        """
+        self._parse_line(''.join(self._pending))
+        self._pending = []
+        return self.resume
+
+    def _parse_line(self, line):
+        line = line.strip()
+        # 跳过空行、代码块标记和 --- 分隔线
+        if not line or line.startswith('```') or RULE_RE.match(line):
+            return
+
+        match = BOLD_HEADER_RE.match(line)
+        if match:
+            self._start_section(match.group(1).strip())
+            return
+
+        match = HEADING_RE.match(line)
+        if match:
+            level, text = len(match.group(1)), match.group(2).replace('**', '').strip()
+            if not text:
+                return
+            if level <= 2:
+                self._start_section(text)
+            else:
+                self._current.lines.append(('subheader', text))
+            return
+
+        # 第一个分节标题之前或联系方式分节中带有 | 或 @ 的第一行视为联系方式
+        in_contact = self._current is self._contact_section
+        if (self.resume.contact is None and (in_contact or not self.resume.sections)
+                and ('|' in line or '@' in line)):
+            match = BULLET_RE.match(line)
+            self.resume.contact = (match.group(1) if match else line).replace('**', '').strip()
+            return
+
+        if in_contact and self._current not in self.resume.sections:
+            self.resume.sections.append(self._current)
+
+        match = BULLET_RE.match(line)
+        if match:
+            self._current.lines.append(('bullet', match.group(1).strip()))
+        else:
+            self._current.lines.append(('text', line))
+
+    def _start_section(self, title):
+        self._current = ResumeSection(title)
+        if title.lower().rstrip(':：') in CONTACT_TITLES:
+            self._contact_section = self._current
+        else:
+            self.resume.sections.append(self._current)
+
+
+def parse_resume(content):
+    """
+    Parse a complete resume string
+    :param content: Resume Markdown
+    :return: ParsedResume
+    """
+    parser = ResumeParser()
+    parser.feed(content)
+    return parser.close()